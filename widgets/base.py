@@ -1,17 +1,37 @@
 '''Fundamental classes and functions for widgets.'''
 
-import hashlib
-import sys
-from copy import copy
-from StringIO import StringIO
-import subprocess
+import zlib
 
 from django.template import Template, Context
-from django.template.loader import render_to_string
+from django.template.loader import get_template, render_to_string
 from django.forms import Media
+from django.utils import simplejson
 from django.utils.safestring import mark_safe
 from django.conf import settings
 
+from widgets.command_parser import index_options
+from widgets.options import option_schema
+from widgets.utils import (
+    BoundedCache, cached_import, cached_property, freeze_options,
+    options_to_tag_string, options_to_query_string)
+
+
+# Generated uids, keyed on (widget class, frozen options).
+_uid_cache = BoundedCache(4096)
+
+# Compiled wrapper templates, keyed on template name.
+_wrapper_template_cache = {}
+
+
+def _get_wrapper_template():
+    '''Return the (cached) template that surrounds every rendered widget.'''
+    path = getattr(settings, 'WIDGET_WRAPPER_TEMPLATE', 'widgets/wrapper.html')
+    try:
+        return _wrapper_template_cache[path]
+    except KeyError:
+        template = _wrapper_template_cache[path] = get_template(path)
+        return template
+
 
 class ClassProperty(property):
     """So we can use a classmethod as a property.
@@ -24,9 +44,46 @@ class ClassProperty(property):
         return self.fget.__get__(None, owner)()
 
 
+class WidgetMeta(type):
+    '''
+    Metaclass for widgets. Builds the lookup tables for a widget's options
+    when the class is defined, or when its options are replaced.
+
+    '''
+    def __init__(cls, name, bases, attrs):
+        super(WidgetMeta, cls).__init__(name, bases, attrs)
+        cls._resolve_options()
+
+    def __setattr__(cls, name, value):
+        super(WidgetMeta, cls).__setattr__(name, value)
+        if name == 'options':
+            cls._resolve_options()
+
+    def __delattr__(cls, name):
+        super(WidgetMeta, cls).__delattr__(name)
+        if name == 'options':
+            cls._resolve_options()
+
+    def _resolve_options(cls):
+        options = cls.options
+        cls._option_index = index_options(options)
+        cls._option_schema = option_schema(options)
+        # (name, short form, long form, takes argument) per option.
+        cls._arg_plan = tuple(
+            (opt.name, opt.short_form or opt.long_form, opt.long_form,
+             opt.takes_argument)
+            for opt in options)
+        # subclasses that inherit these options need their tables rebuilt too
+        for subclass in cls.__subclasses__():
+            if 'options' not in subclass.__dict__:
+                subclass._resolve_options()
+
+
 class WidgetBase(object):
     '''Base class for all widgets.'''
 
+    __metaclass__ = WidgetMeta
+
     options = []
     example = {}
 
@@ -52,14 +109,24 @@ class WidgetBase(object):
         templates, but we want to expose this for convenience.
 
         '''
-        return str(cls.__name__)
+        return cls.__name__
 
     @classmethod
     def qualified_classname(cls):
         '''Helper method to return the class name with module prepended.'''
-        return "%s.%s" % (cls.__module__, cls.__name__)
+        if '_qualified_classname' not in cls.__dict__:
+            cls._qualified_classname = "%s.%s" % (cls.__module__, cls.__name__)
+        return cls._qualified_classname
+
+    @classmethod
+    def source_file(cls):
+        '''Return the file this widget is defined in, for debugging.'''
+        if '_source_file' not in cls.__dict__:
+            import inspect
+            cls._source_file = inspect.getsourcefile(cls)
+        return cls._source_file
 
-    @property
+    @cached_property
     def media(self):
         '''
         The media property, using django's :py:class:`Media` class.
@@ -68,7 +135,9 @@ class WidgetBase(object):
         adding in other media (e.g. for maps) would be done here.
 
         By default, uses js_media and css_media attributes on the class to
-        build a :py:class:`Media` object.
+        build a :py:class:`Media` object. The object is built once per widget
+        instance; subclasses that change their media at runtime should
+        override this with a plain property.
 
         '''
         return Media(
@@ -77,11 +146,28 @@ class WidgetBase(object):
 
     def generate_uid(self, options):
         '''A uid for a widget that should be unique per page.'''
-        uid = hashlib.md5()
-        for item in sorted(options.items()):
-            uid.update(str(item))
-        uid.update(self.__class__.__name__)
-        return "generated_%s" % uid.hexdigest()
+        cls = self.__class__
+        frozen = freeze_options(options)
+        if frozen is None:
+            return cls._generate_uid(options)
+        key = (cls, frozen)
+        try:
+            return _uid_cache[key]
+        except KeyError:
+            uid = _uid_cache[key] = cls._generate_uid(options)
+            return uid
+
+    @classmethod
+    def _generate_uid(cls, options):
+        # The id only has to be unique within a page, so a pair of cheap
+        # checksums over a single buffer will do; no need for md5.
+        # Serialise the options in one call, sorted so the result is canonical.
+        buf = "%s|%s" % (
+            simplejson.dumps(options, sort_keys=True, default=repr,
+                             separators=(',', ':')),
+            cls.__name__)
+        return "generated_%08x%08x" % (zlib.crc32(buf) & 0xffffffff,
+                                       zlib.adler32(buf) & 0xffffffff)
 
     def _render_wrapper(self, options, context, **kwargs):
         '''
@@ -89,34 +175,34 @@ class WidgetBase(object):
         context.
 
         '''
-        saved_context_dicts = copy(context.dicts)
+        depth = len(context.dicts)
         context.push()
 
-        # default uid can be overridden in kwargs
-        context['uid'] = self.generate_uid(options)
+        # default uid can be overridden in kwargs, in which case there is no
+        # need to generate one
+        if 'uid' not in kwargs:
+            context['uid'] = self.generate_uid(options)
         context['classname'] = self.__class__.__name__
         context['options'] = options
         context['qualified_classname'] = self.qualified_classname()
-        if 'widget_debug' in context and context['widget_debug']:
-            import inspect
-            from widgets.utils import (
-                options_to_tag_string, options_to_query_string)
-            context['css'] = self.media._css
-            context['js'] = self.media._js
+        if context.get('widget_debug'):
+            media = self.media
+            context['css'] = media._css
+            context['js'] = media._js
             context['query_string'] = options_to_query_string(
                 self.__class__,
                 options)
             context['tag_string'] = options_to_tag_string(
                 self.__class__,
                 options)
-            context['widget_file'] = inspect.getsourcefile(self.__class__)
+            context['widget_file'] = self.source_file()
         context.update(kwargs)
         rendered_widget = self.render(options, context)
 
         # Pop back context scope to state before widget render.  We can't rely
         # on a single 'Context.pop' because 'Context.update' also pushes a new
-        # scope.
-        context.dicts = saved_context_dicts
+        # scope, so drop every scope added since.
+        del context.dicts[depth:]
 
         return mark_safe(rendered_widget)
 
@@ -144,15 +230,19 @@ class WidgetBase(object):
         else:
             context['rendered_widget'] = render_to_string(template, context)
             context['widget_template'] = template
-        return render_to_string(
-            getattr(
-                settings,
-                'WIDGET_WRAPPER_TEMPLATE',
-                'widgets/wrapper.html'),
-            context)
-
-    def downloadable_as(self):
+        return _get_wrapper_template().render(context)
+
+    @classmethod
+    def _implements(cls, method):
+        '''Has `method` been overridden from :py:class:`WidgetBase`?'''
+        return (getattr(cls, method).im_func is not
+                getattr(WidgetBase, method).im_func)
+
+    @classmethod
+    def downloadable_as(cls):
         """Which types have been implemented?"""
+        if '_downloadable_as' in cls.__dict__:
+            return cls._downloadable_as
         avail = {
             'csv': 'CSV',
             'svg': 'SVG',
@@ -161,16 +251,14 @@ class WidgetBase(object):
         }
         enabled = {}
         for _as in avail.keys():
-            try:
-                getattr(self, 'as_%s' % _as)({}, None, {})
-            except NotImplementedError:
-                continue
-            except:  # any others are expected as we didn't give opts etc
-                pass
-            enabled[_as] = avail[_as]
-        if len(enabled.keys()) == 0:
-            return None
-
+            if cls._implements('as_%s' % _as):
+                enabled[_as] = avail[_as]
+        # The default as_png converts from as_svg, and as_html just renders.
+        if 'svg' in enabled:
+            enabled['png'] = avail['png']
+        enabled['html'] = avail['html']
+
+        cls._downloadable_as = enabled
         return enabled
 
     def as_html(self, options, fp):
@@ -211,22 +299,16 @@ class WidgetBase(object):
         Pass extra PNG-specific options to the renderer using the
         `render_options` argument.
 
-        The default implementation will call as_svg and attempt to convert
-        the output to PNG using ImageMagick.
+        The default implementation will call as_svg and convert the output to
+        PNG, using cairosvg if it is installed or ImageMagick otherwise.
 
         """
+        from io import BytesIO
+
         # try to generate an SVG and then convert to PNG
-        svg_fp = StringIO()
-        self.as_svg(options, svg_fp, render_options)
-        svg_fp.seek(0)
-        p = subprocess.Popen(['convert','-background','none','svg:-','png:-'],
-                             stdin=subprocess.PIPE,
-                             stdout=subprocess.PIPE, 
-                             stderr=subprocess.PIPE)
-        out,err = p.communicate(svg_fp.read())
-        if p.wait():
-            raise RuntimeError("Failed to convert to SVG\n%s" % err)
-        fp.write(out)
+        svg_fp = BytesIO()
+        self.as_svg(options, _Utf8Writer(svg_fp), render_options)
+        fp.write(_svg_to_png(svg_fp.getvalue()))
 
     def as_design(self, options, *args):
         """
@@ -237,20 +319,75 @@ class WidgetBase(object):
         return []
 
 
+class _Utf8Writer(object):
+    '''Wraps a byte stream, encoding unicode as UTF-8 before writing it.'''
+    def __init__(self, fp):
+        self.fp = fp
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self.fp.write(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def __getattr__(self, name):
+        return getattr(self.fp, name)
+
+
+def _convert_svg_to_png(svg):
+    '''Convert an SVG document to PNG using ImageMagick's `convert`.'''
+    import subprocess
+    p = subprocess.Popen(['convert','-background','none','svg:-','png:-'],
+                         stdin=subprocess.PIPE,
+                         stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE)
+    out,err = p.communicate(svg)
+    if p.wait():
+        raise RuntimeError("Failed to convert to SVG\n%s" % err)
+    return out
+
+
+# SVG to PNG converter, chosen by _svg_to_png on first use.
+_svg_converter = None
+
+
+def _svg_to_png(svg):
+    '''
+    Convert an SVG document to PNG. Uses cairosvg in-process when available,
+    falling back to ImageMagick's `convert`.
+
+    '''
+    global _svg_converter
+    if _svg_converter is None:
+        try:
+            import cairosvg
+        except ImportError:
+            _svg_converter = _convert_svg_to_png
+        else:
+            _svg_converter = lambda svg: cairosvg.svg2png(bytestring=svg)
+    return _svg_converter(svg)
+
+
+# Widget classes loaded by get_widget_class, keyed on qualified name.
+_widget_class_cache = {}
+
+
 def get_widget_class(name):
     '''
     Load the widget class provided.
     :param name: a fully qualified python class name.
     '''
-    # load the widget class
-    path = name.split('.')
-    module_name = ".".join(path[:-1])
-    class_name = path[-1]
+    try:
+        return _widget_class_cache[name]
+    except KeyError:
+        pass
 
-    # import the module if needed
-    if module_name not in sys.modules:
-        __import__(module_name)
-    module = sys.modules[module_name]
+    # load the widget class
+    module_name, _, class_name = name.rpartition('.')
+    module = cached_import(module_name)
 
     # find the class and check it is a widget
     assert class_name in module.__dict__, \
@@ -259,4 +396,5 @@ def get_widget_class(name):
     assert issubclass(widget_class, WidgetBase), \
         "%s does not inherit from WidgetBase" % name
 
+    _widget_class_cache[name] = widget_class
     return widget_class
@@ -7,23 +7,41 @@ This is used in parsing widget template tags such as::
 
 import re
 
+# Split on spaces, keeping quoted strings together.
+_SPLIT_RE = re.compile(r'''( |"[^"]*"|'[^']*')''')
+
 
 class OptionParserError(Exception):
     pass
 
 
+def _is_flag_bundle(token):
+    '''Does `token` need expanding, e.g. -abc or a lone hyphen?'''
+    return (token.startswith('-') and not token.startswith('--') and
+            len(token) != 2)
+
+
 class OptionLexer(object):
     '''Parses an argument string into tokens and expands options.'''
 
     def __init__(self, arguments):
-        # If we are given a string, split it
+        # If we are given a string, split it. Without quotes there is no need
+        # for the regular expression.
         if isinstance(arguments, basestring):
-            arguments = re.split("( |\\\".*?\\\"|'.*?')", arguments.strip())
+            if '"' not in arguments and "'" not in arguments:
+                arguments = arguments.split()
+            else:
+                arguments = _SPLIT_RE.split(arguments.strip())
 
         # Assume we have a list of strings here
         assert hasattr(arguments, '__iter__')
 
-        self._iterator = self._expanded(arguments)
+        arguments = list(arguments)
+        if any(_is_flag_bundle(token) for token in arguments):
+            self._iterator = self._expanded(arguments)
+        else:
+            # Nothing to expand, just discard whitespace.
+            self._iterator = (token for token in arguments if token.strip())
         self.exhausted = False
         self.token = None
 
@@ -56,23 +74,42 @@ class OptionLexer(object):
         return self._iterator
 
 
-def _find_option(option_list, arg):
-    '''Find an option by form or long_form, or raise an error'''
+def index_options(option_list):
+    '''
+    Return a dictionary mapping the short and long forms to each option. Where
+    options share a form, the first one in the list wins.
+
+    '''
+    index = {}
     for opt in option_list:
-        if opt.short_form == arg or opt.long_form == arg:
-            return opt
-    raise OptionParserError("Unknown argument: %s" % arg)
+        if opt.short_form and opt.short_form not in index:
+            index[opt.short_form] = opt
+        if opt.long_form and opt.long_form not in index:
+            index[opt.long_form] = opt
+    return index
+
+
+def _find_option(option_index, arg):
+    '''Find an option by form or long_form, or raise an error'''
+    try:
+        return option_index[arg]
+    except KeyError:
+        raise OptionParserError("Unknown argument: %s" % arg)
 
 
-def parse_argument_list(option_list, arguments):
+def parse_argument_list(option_list, arguments, option_index=None):
     '''
     Parse a string using `option_list`.
 
     :param option_list: A list of :py:class:`Option` objects.
     :param arguments: A string representing values.
+    :param option_index: Optional result of :py:func:`index_options` for
+        `option_list`, to save rebuilding it.
     :returns: List of (option, value)
 
     '''
+    if option_index is None:
+        option_index = index_options(option_list)
     values = []
     lexer = OptionLexer(arguments)
 
@@ -80,7 +117,7 @@ def parse_argument_list(option_list, arguments):
     lexer.consume()
 
     while not lexer.exhausted:
-        opt = _find_option(option_list, lexer.token)
+        opt = _find_option(option_index, lexer.token)
         lexer.consume()
         values.append((opt, opt.parse_tokens(lexer)))
 
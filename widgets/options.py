@@ -1,6 +1,8 @@
 '''Options for use in the :py:attr:`options` property of widgets.'''
 import logging
+import threading
 
+from django.core.signals import request_started, request_finished
 from django.db import models
 from django.forms import CheckboxInput, TextInput
 from django.template import Variable
@@ -13,41 +15,77 @@ class OptionError(Exception):
     pass
 
 
+# Query results for options, shared between the widgets rendered by a single
+# request. Only active inside a request, so nothing is cached across requests
+# or outside the request cycle.
+_request_cache = threading.local()
+
+
+def _start_request_cache(**kwargs):
+    _request_cache.lookups = {}
+
+
+def _end_request_cache(**kwargs):
+    _request_cache.lookups = None
+
+request_started.connect(_start_request_cache,
+                        dispatch_uid='widgets.options.request_cache')
+request_finished.connect(_end_request_cache,
+                         dispatch_uid='widgets.options.request_cache')
+
+
 class Values(dict):
     '''Class to expose dict values as attrs for convenience.'''
 
-    def __getattr__(self, name):
-        return self[name]
+    __slots__ = ()
+
+    # Look up missing attributes straight from the dict, without an extra
+    # Python-level call.
+    __getattr__ = dict.__getitem__
 
 
-def process_values(values, options):
+def option_schema(options):
+    '''
+    Return frozensets of the required and of all option names in `options`.
+
+    '''
+    return (frozenset(opt.name for opt in options if opt.required),
+            frozenset(opt.name for opt in options))
+
+
+def process_values(values, options, schema=None):
     '''
     Given a dictionary of values, check required options are present and filter
     the options according to their class.
 
     :param values: Dictionary of values.
     :param options: List of :py:class:`Option`.
+    :param schema: Optional result of :py:func:`option_schema` for `options`,
+        to save rebuilding it.
     :returns: Dictionary of processed values.
     '''
-    # Check for required options
-    required = set(option.name for option in options if option.required)
-    missing = required - set(values.keys())
+    if schema is None:
+        schema = option_schema(options)
+    required, names = schema
 
-    if len(missing) > 0:
-        raise OptionError("Missing arguments: %s" % missing)
+    # Check for required options
+    missing = required.difference(values)
+    if missing:
+        raise OptionError("Missing arguments: %s" % set(missing))
 
     # Check arguments
-    names = set(option.name for option in options)
-    unknown = set(values.keys()) - names
-
-    if len(unknown) > 0:
+    if not names.issuperset(values):
+        unknown = set(values).difference(names)
         raise OptionError("Unknown arguments: %s" % unknown)
 
     # Return filtered options
-    logging.debug(values)
-    logging.debug(options)
-    return Values((opt.name, opt.filter(values.get(opt.name, opt.default)))
-                  for opt in options)
+    if logging.root.isEnabledFor(logging.DEBUG):
+        logging.debug(values)
+        logging.debug(options)
+    processed = Values()
+    for opt in options:
+        processed[opt.name] = opt.filter(values.get(opt.name, opt.default))
+    return processed
 
 
 class Option(object):
@@ -65,6 +103,9 @@ class Option(object):
 
     '''
 
+    # Whether the option is followed by a value on the command line.
+    takes_argument = True
+
     @property
     def classname(self):
         """Used in templates etc where __class__ not allowed."""
@@ -131,6 +172,8 @@ class BoolOption(Option):
     Displays in forms as a checkbox.
 
     '''
+    takes_argument = False
+
     def __init__(self, *args, **kwargs):
         super(BoolOption, self).__init__(*args, **kwargs)
         self.required = False
@@ -227,6 +270,20 @@ class ListOption(MultiOption):
 
 
 class _QueryOptionMixin(object):
+    def _cached_lookup(self, value, lookup):
+        '''Return `lookup(value)`, reusing the result within a request.'''
+        cache = getattr(_request_cache, 'lookups', None)
+        if cache is None:
+            return lookup(value)
+        key = (self, value)
+        try:
+            return cache[key]
+        except KeyError:
+            result = cache[key] = lookup(value)
+            return result
+        except TypeError:  # unhashable value
+            return lookup(value)
+
     def get_choices(self):
         if self._fields:
             return self._query.values_list(*self._fields)
@@ -252,7 +309,10 @@ class ForeignKeyOption(SelectOption, _QueryOptionMixin):
         if isinstance(value, models.Model):
             return value
         if value:
-            return self._query.get(**{self.key: value})
+            return self._cached_lookup(value, self._get)
+
+    def _get(self, value):
+        return self._query.get(**{self.key: value})
 
     def get_raw_value(self, value):
         if isinstance(value, models.Model):
@@ -274,5 +334,15 @@ class MultiForeignKeyOption(MultiOption, _QueryOptionMixin):
         if isinstance(value, models.Model):
             return value
         if value:
-            key = "%s__in" % self.key
-            return self._query.filter(**{key: value})
+            # Only query for the values that aren't already instances.
+            instances = [v for v in value if isinstance(v, models.Model)]
+            keys = tuple(v for v in value if not isinstance(v, models.Model))
+            if not keys:
+                return instances
+            queryset = self._cached_lookup(keys, self._filter)
+            if not instances:
+                return queryset
+            return instances + list(queryset)
+
+    def _filter(self, keys):
+        return self._query.filter(**{"%s__in" % self.key: keys})
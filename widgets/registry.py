@@ -10,18 +10,94 @@ agree on that doesn't conflict with a namespace), and these will automatically
 be loaded etc on init.
 
 """
-import os
-import pkgutil
-import inspect
 import logging
-
-from django.utils.importlib import import_module
-from django.utils.datastructures import SortedDict
+import os
 
 from widgets.base import WidgetBase, get_widget_class
+from widgets.utils import cached_import
 
 log = logging.getLogger(__name__)
 
+# Suffixes of importable module files.
+_MODULE_SUFFIXES = ('.py', '.pyc', '.pyo', '.so')
+
+# Directory listings, as autodiscover looks through the same directories for
+# every app. None for paths that can't be listed, e.g. zipped eggs.
+_DIR_CACHE = {}
+
+
+def _listdir(path):
+    """Return the set of filenames in `path`, or None if not a directory."""
+    try:
+        return _DIR_CACHE[path]
+    except KeyError:
+        try:
+            filenames = frozenset(os.listdir(path))
+        except OSError:
+            filenames = None
+        _DIR_CACHE[path] = filenames
+        return filenames
+
+
+def _find_module(path, name):
+    """Look for module `name` in directory `path`.
+
+    Returns None if it isn't there, otherwise whether it is a package.
+
+    """
+    filenames = _listdir(path)
+    if filenames is None:  # let pkgutil deal with anything unusual
+        import pkgutil
+        for _, modnm, ispkg in pkgutil.iter_modules([path]):
+            if modnm == name:
+                return ispkg
+        return None
+
+    if name in filenames:
+        package = _listdir(os.path.join(path, name))
+        if package is not None:
+            for suffix in _MODULE_SUFFIXES:
+                if '__init__' + suffix in package:
+                    return True
+    for suffix in _MODULE_SUFFIXES:
+        if name + suffix in filenames:
+            return False
+    return None
+
+
+def _iter_modules(paths):
+    """Yield (name, ispkg) for the modules in `paths`, like pkgutil.
+
+    A name found in more than one path is only yielded for the first.
+
+    """
+    yielded = set()
+    for path in paths:
+        filenames = _listdir(path)
+        if filenames is None:
+            import pkgutil
+            modules = [(modnm, ispkg)
+                       for _, modnm, ispkg in pkgutil.iter_modules([path])]
+        else:
+            names = set()
+            for filename in filenames:
+                name, ext = os.path.splitext(filename)
+                if not ext or ext in _MODULE_SUFFIXES:
+                    names.add(name)
+            names.discard('__init__')
+            modules = []
+            for name in sorted(names):
+                if '.' in name:
+                    continue
+                ispkg = _find_module(path, name)
+                if ispkg is not None:
+                    modules.append((name, ispkg))
+        for name, ispkg in modules:
+            if name not in yielded:
+                yielded.add(name)
+                yield name, ispkg
+
+
 class Registry(object):
     """A class for registering widgets to.
 
@@ -32,64 +108,93 @@ class Registry(object):
 
     def __init__(self):
         self._register = {}
+        self._by_app = {}
+
+    def _insert(self, name, widget):
+        """Register `widget` as `name`. Returns False if already there."""
+        if name in self._register:
+            return False
+        self._register[name] = widget
+        self._by_app.setdefault(name.split('.', 1)[0], []).append(widget)
+        return True
 
     def register_by_qualified_name(self, name):
         """Add the widget by name, if it isn't already there."""
         if name in self._register:
             return
-        self._register[name] = get_widget_class(name)
+        self._insert(name, get_widget_class(name))
+
+    def _add_classes(self, app_name, widget_noun, modnm=None, added=None):
+        """Add the module's classes to the registry.
 
-    def _add_classes(self, app_name, widget_noun, modnm=None):
-        """Add the module's classes to the registry."""
+        The names of newly registered widgets are appended to `added`, if
+        given, so they can be rolled back.
+
+        """
         if modnm in ('options',):  # don't import
             return
         widget_path = ".".join([app_name, widget_noun])
         if modnm:  # if the widgets is a 'package' then there'll be modnm too
             widget_path = widget_path + "." + modnm
-        widget_module = import_module(widget_path)
-        for name, obj in inspect.getmembers(widget_module):
-            if (inspect.isclass(obj) and  # check it's a class
+        widget_module = cached_import(widget_path)
+        for name, obj in vars(widget_module).items():
+            if (isinstance(obj, type) and  # check it's a class
                 obj.__module__ == widget_path and  # and from this module
                 issubclass(obj, WidgetBase)):  # and subclasses WidgetBase
                 # the name as it appears in the import tag:
                 fully_qualified_widget = ".".join([widget_path, name])
                 # add it to the registry
-                self._register.setdefault(fully_qualified_widget, obj)
+                if (self._insert(fully_qualified_widget, obj) and
+                    added is not None):
+                    added.append(fully_qualified_widget)
 
-    def register(self, app_name, widget_noun='widgets'):
+    def register(self, app_name, widget_noun='widgets', added=None):
         """Try and add this app's widgets to the registry."""
         package = __import__(app_name)
-        for _, modnm1, ispkg1 in pkgutil.iter_modules(package.__path__):
-            if modnm1 == widget_noun:  # see if the widgets module exists
-                if ispkg1:  # if it is a package, then descend in...
-                    for _, modnm2, ispkg2 in pkgutil.iter_modules([
-                    os.path.join(package.__path__[0], widget_noun)]):
-                        self._add_classes(app_name, widget_noun, modnm2)
-                else:  # its just a widgets.py file.
-                    self._add_classes(app_name, widget_noun)
-
-    def register_main(self, app_name):
+        for path in package.__path__:
+            ispkg = _find_module(path, widget_noun)
+            if ispkg is not None:
+                break
+        else:  # no widgets module
+            return
+        if ispkg:  # if it is a package, then descend in...
+            for modnm, _ in _iter_modules([os.path.join(path, widget_noun)]):
+                self._add_classes(app_name, widget_noun, modnm, added)
+        else:  # its just a widgets.py file.
+            self._add_classes(app_name, widget_noun, added=added)
+
+    def register_main(self, app_name, added=None):
         """Try and add this app's widgets to the registry."""
         package = __import__(app_name)
-        for _, modnm1, ispkg1 in pkgutil.iter_modules(package.__path__):
-            self._add_classes(app_name, modnm1)
+        for modnm, _ in _iter_modules(package.__path__):
+            self._add_classes(app_name, modnm, added=added)
+
+    def _rollback(self, added):
+        """Remove the widgets named in `added` from the registry."""
+        for name in added:
+            widget = self._register.pop(name, None)
+            if widget is not None:
+                app = name.split('.', 1)[0]
+                self._by_app[app].remove(widget)
+                if not self._by_app[app]:
+                    del self._by_app[app]
 
     def widgets_by_app(self):
-        """Return an app->[widgets] dict."""
-        apps = {}
-        for cls, widget in self._register.items():
-            app = cls.split('.')[0]
-            apps.setdefault(app, []).append(widget)
-        return apps
+        """Return an app->[widgets] dict.
+
+        The dict is kept up to date as widgets are registered, so should not be
+        modified.
+
+        """
+        return self._by_app
 
     def find(self, classname):
         """Return a registered widget or register and return by classname."""
-        if classname in self._register:
-            return self._register[classname]
-        else:
-            self.register_by_qualified_name(classname)
-            assert classname in self._register
-            return self._register[classname]
+        widget = self._register.get(classname)
+        if widget is None:
+            widget = get_widget_class(classname)
+            self._insert(classname, widget)
+        return widget
 
 
 # This global object will hold all registered widgets.
@@ -103,20 +208,20 @@ def autodiscover(widget_noun='widgets'):
     Just specify the noun you want, really.
 
     """
-    import copy
     from django.conf import settings
     from django.utils.importlib import import_module
     from django.utils.module_loading import module_has_submodule
 
     for app in settings.INSTALLED_APPS:
         mod = import_module(app)
-        # Attempt to import the app's widgets module.
+        # Attempt to import the app's widgets module, keeping track of what
+        # gets registered so it can be undone.
+        added = []
         try:
-            before_import_register = copy.copy(registry._register)
-            registry.register(app, widget_noun)
+            registry.register(app, widget_noun, added)
         except Exception, e:
             log.error(e)
-            registry._register = before_import_register
+            registry._rollback(added)
 
             # Decide whether to bubble up this error. If the app just
             # doesn't have a widgets module, we can ignore the error
@@ -125,10 +230,10 @@ def autodiscover(widget_noun='widgets'):
                 raise e
 
     # autodiscover main gidgits directory
+    added = []
     try:
         mod = import_module(widget_noun)
-        before_import_register = copy.copy(registry._register)
-        registry.register_main(widget_noun)
+        registry.register_main(widget_noun, added)
     except Exception, e:
         log.error(e)
-        registry._register = before_import_register
+        registry._rollback(added)
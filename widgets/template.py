@@ -1,3 +1,5 @@
+import weakref
+
 from django.http import HttpResponse
 from django.template import loader, Context, loader_tags, defaulttags, Template
 from django.forms import Media
@@ -5,28 +7,119 @@ from django.forms import Media
 from widgets.templatetags.widget_tags import WidgetRenderNode
 
 
-def _find_widget_nodes(nodelist):
-    '''Traverse the nodes of a template and extract all widgets.'''
+# The widget nodes and the extended/included templates found directly in each
+# template. Templates don't change once loaded.
+_WIDGET_NODE_CACHE = weakref.WeakKeyDictionary()
+
+# Templates extended by name, so 'extends' chains aren't reloaded each time.
+_PARENT_TEMPLATE_CACHE = {}
+
 
+def _get_parent_template(name):
+    try:
+        return _PARENT_TEMPLATE_CACHE[name]
+    except KeyError:
+        template = _PARENT_TEMPLATE_CACHE[name] = loader.get_template(name)
+        return template
+
+
+def _walk_nodelist(nodelist, widgets, extends, includes):
+    '''
+    Sort the nodes in `nodelist`, and all nodelists below it, into widgets,
+    'extends' and 'include' nodes in a single pass.
+
+    '''
+    for node in nodelist:
+        if isinstance(node, WidgetRenderNode):
+            widgets.append(node)
+        elif isinstance(node, loader_tags.ExtendsNode):
+            extends.append(node)
+        elif isinstance(node, loader_tags.ConstantIncludeNode):
+            includes.append(node)
+        for attr in getattr(node, 'child_nodelists', ('nodelist',)):
+            child = getattr(node, attr, None)
+            if child:
+                _walk_nodelist(child, widgets, extends, includes)
+
+
+def _scan_nodelist(nodelist):
+    '''
+    Return the widget nodes in `nodelist`, and the templates it extends or
+    includes.
+
+    '''
     # This will recursively decend through the nodes to find any
     # widgets. This includes the body of an 'extends' tag.
-    widgets = list(nodelist.get_nodes_by_type(WidgetRenderNode))
+    widgets, extends, includes = [], [], []
+    _walk_nodelist(nodelist, widgets, extends, includes)
+    templates = []
 
     # Traverse up through 'extends' tags.
-    for ext in nodelist.get_nodes_by_type(loader_tags.ExtendsNode):
+    for ext in extends:
         # note that we can only traverse non-variable 'extends' as we do not
         # have a context.
         if ext.parent_name:
-            tpl = loader.get_template(ext.parent_name)
-            widgets.extend(_find_widget_nodes(tpl.nodelist))
+            templates.append(_get_parent_template(ext.parent_name))
 
     # Traverse down through (constant) 'include' tags
-    for inc in nodelist.get_nodes_by_type(loader_tags.ConstantIncludeNode):
-        widgets.extend(_find_widget_nodes(inc.template.nodelist))
+    for inc in includes:
+        if inc.template is not None:
+            templates.append(inc.template)
 
+    return tuple(widgets), tuple(templates)
+
+
+def _template_widget_nodes(template, _seen=None):
+    '''
+    Return a list of all widgets in `template`. Templates already in `_seen`
+    are skipped, so one reached by several paths is only searched once.
+
+    '''
+    if _seen is None:
+        _seen = set()
+    if template in _seen:
+        return []
+    _seen.add(template)
+
+    try:
+        scan = _WIDGET_NODE_CACHE[template]
+    except KeyError:
+        scan = _WIDGET_NODE_CACHE[template] = _scan_nodelist(template.nodelist)
+    return _collect_widget_nodes(scan, _seen)
+
+
+def _collect_widget_nodes(scan, _seen):
+    widgets, templates = scan
+    widgets = list(widgets)
+    for tpl in templates:
+        widgets.extend(_template_widget_nodes(tpl, _seen))
     return widgets
 
 
+def _merge_media(media, others):
+    '''
+    Add the CSS and JS from each of the `others` to `media`, skipping
+    duplicates. Media.add_css/add_js check for duplicates with a list scan per
+    file, so sets are used instead.
+
+    '''
+    css, js = media._css, media._js
+    seen_css = dict((medium, set(paths)) for medium, paths in css.items())
+    seen_js = set(js)
+    for other in others:
+        for medium, paths in other._css.items():
+            seen = seen_css.setdefault(medium, set())
+            for path in paths:
+                if path not in seen:
+                    seen.add(path)
+                    css.setdefault(medium, []).append(path)
+        for path in other._js:
+            if path not in seen_js:
+                seen_js.add(path)
+                js.append(path)
+    return media
+
+
 def render_to_response(template_path, context={}, context_instance=None,
                        variable_templates=None, media=None):
     '''
@@ -89,14 +182,13 @@ class WidgetTemplateWrapper(object):
         variable_includes_ = variable_includes or []
 
         self.template = template
-        self.widget_nodes = _find_widget_nodes(template.nodelist)
+        seen = set()
+        self.widget_nodes = _template_widget_nodes(template, seen)
         for template_ in variable_includes_:
-            self.widget_nodes.extend(_find_widget_nodes(template_.nodelist))
+            self.widget_nodes.extend(_template_widget_nodes(template_, seen))
 
-        self.media = media or Media()
-        for node in self.widget_nodes:
-            self.media.add_css(node.media._css)
-            self.media.add_js(node.media._js)
+        self.media = _merge_media(
+            media or Media(), [node.media for node in self.widget_nodes])
 
     def render(self, context):
         '''Returns a string of the rendered template.'''
@@ -38,9 +38,13 @@ from django.template.loader import get_template
 from widgets.options import process_values
 from widgets.registry import registry as widget_registry
 from widgets.command_parser import parse_argument_list
+from widgets.utils import (
+    BoundedCache, cached_property, options_to_query_string)
 
 register = template.Library()
 
+_DECAMEL_RE = re.compile(r"([A-Z])")
+
 
 # For friendly failure, consider subclassing this node and catching exceptions
 # in the appropriate methods. The tag could be called 'safe_widget'. The node
@@ -54,17 +58,22 @@ class WidgetRenderNode(template.Node):
         widget_class = widget_registry.find(classname)
         self.as_name = as_name
         self.widget = widget_class()
-        self.values = parse_argument_list(widget_class.options, arguments)
+        self.values = parse_argument_list(
+            widget_class.options, arguments, widget_class._option_index)
+        # What to resolve against the context on each render.
+        self._resolve_plan = [(opt.name, opt.resolve_value, value)
+                              for opt, value in self.values]
 
-    @property
+    @cached_property
     def media(self):
         return self.widget.media
 
     def render(self, context):
-        from widgets.utils import options_to_query_string
-        resolved = dict((opt.name, opt.resolve_value(context, value))
-                        for opt, value in self.values)
-        options = process_values(resolved, self.widget.options)
+        resolved = {}
+        for name, resolve, value in self._resolve_plan:
+            resolved[name] = resolve(context, value)
+        options = process_values(resolved, self.widget.options,
+                                 self.widget._option_schema)
 
         as_name = self.as_name
         if as_name:
@@ -107,21 +116,36 @@ def _is_literal_string(value):
     return value.startswith('"') or value.startswith("'")
 
 
+# Box templates named by variables, keyed on the resolved name.
+_box_template_cache = BoundedCache(32)
+
+
+def _get_box_template(name):
+    try:
+        return _box_template_cache[name]
+    except KeyError:
+        template_ = _box_template_cache[name] = get_template(name)
+        return template_
+
+
 class BoxedWidget(WidgetRenderNode):
 
     def __init__(self, template_, title, classname, arguments, as_name=None):
         self.template = template_
-        if not _is_literal_string(self.template):
+        if _is_literal_string(self.template):
+            # A literal name can be loaded once, here.
+            self._template_obj = get_template(template_[1:-1])
+        else:
             self.template = template.Variable(template_)
+            self._template_obj = None
         self.title = title[1:-1]
         super(BoxedWidget, self).__init__(classname, arguments, as_name)
 
     def render(self, context):
         rendered_widget = super(BoxedWidget, self).render(context)
-        if type(self.template) == basestring:
-            template_ = get_template(self.template)
-        else:
-            template_ = get_template(self.template.resolve(context))
+        template_ = self._template_obj
+        if template_ is None:
+            template_ = _get_box_template(self.template.resolve(context))
 
         context.update({
             'box_widget': rendered_widget,
@@ -159,4 +183,4 @@ register.tag('box_widget', box_widget_render_tag)
 @register.filter
 @stringfilter
 def decamel(value):
-    return re.sub(r"([A-Z]{1})", r" \1", value)
+    return _DECAMEL_RE.sub(r" \1", value)
@@ -1,15 +1,19 @@
 from lxml import etree
 
 from unittest import TestCase, main
+from StringIO import StringIO
 
 from django.template import Context, Template
 from django.template.loader import get_template
 from django.test.utils import setup_test_environment
 from django.conf import settings
 
+from widgets import base
 from widgets.command_parser import OptionLexer, OptionParserError
 from widgets.base import WidgetBase
-from widgets.options import Option
+from widgets.options import Option, BoolOption, ListOption
+from widgets.utils import (
+    options_to_command_string, options_to_query_string, options_to_tag_string)
 from widgets.template import WidgetTemplateWrapper
 
 
@@ -31,6 +35,8 @@ class LexerTests(TestCase):
     def test_quotes(self):
         self.assert_lex('"a"', ['"a"'])
         self.assert_lex('a "b c" d', ['a', '"b c"', 'd'])
+        self.assert_lex("a 'b c' d", ['a', "'b c'", 'd'])
+        self.assert_lex('-t "x y" -abc', ['-t', '"x y"', '-a', '-b', '-c'])
 
     def test_consume(self):
         lexer = OptionLexer('--a 1 --b 2')
@@ -74,6 +80,24 @@ class TestWidget3(WidgetBase):
     js_media = ['js1', 'js2', 'js3']
 
 
+class TestWidget4(WidgetBase):
+    def as_svg(self, options, fp, render_options={}):
+        fp.write("<svg/>")
+
+
+class TestWidget5(WidgetBase):
+    options = [
+        Option('name', '-n'),
+        ListOption('items', '-i'),
+        BoolOption('flag', '-f'),
+        ]
+
+
+class TestWidget6(WidgetBase):
+    def as_svg(self, options, fp, render_options={}):
+        fp.write(u"<svg><text>caf\xe9</text></svg>")
+
+
 class TagTests(TestCase):
     def test_render(self):
         c = Context()
@@ -145,6 +169,63 @@ class TagTests(TestCase):
         self.assertEqual(text, "")
 
 
+class UtilsTests(TestCase):
+    def test_command_string(self):
+        options = {'name': 'a', 'flag': True}
+        self.assertEqual(
+            options_to_command_string(TestWidget5, options),
+            "widgets.tests.TestWidget5 --name 'a' --flag")
+        self.assertEqual(
+            options_to_command_string(TestWidget5, options, short=True),
+            "widgets.tests.TestWidget5 -n 'a' -f")
+
+    def test_tag_string(self):
+        self.assertEqual(
+            options_to_tag_string(
+                TestWidget5,
+                {'name': 'a<b', 'items': ['x', 'y'], 'flag': True}),
+            '--name "a&lt;b" --items "x" "y" --flag')
+
+    def test_query_string(self):
+        self.assertEqual(
+            options_to_query_string(
+                TestWidget5,
+                {'name': 'a b', 'items': ['x', 'y'], 'flag': True}),
+            "name=a%20b&items=x&items=y&flag=")
+        self.assertEqual(
+            options_to_query_string(
+                TestWidget5, {'name': 'a', 'items': [], 'flag': False}),
+            "name=a")
+        self.assertEqual(
+            options_to_query_string(TestWidget5, {'items': ['x']}),
+            "items=x")
+
+    def test_options_replaced(self):
+        class Widget(WidgetBase):
+            options = [Option('name', '-n')]
+
+        class Child(Widget):
+            pass
+
+        for widget_class in (Widget, Child):
+            self.assertEqual(
+                options_to_command_string(
+                    widget_class, {'name': 'a'}, short=True),
+                "widgets.tests.%s -n 'a'" % widget_class.__name__)
+            self.assertEqual(
+                options_to_tag_string(widget_class, {'name': 'a'}),
+                '--name "a"')
+        Widget.options = [Option('name', '-x', '--other')]
+        for widget_class in (Widget, Child):
+            self.assertEqual(
+                options_to_command_string(
+                    widget_class, {'name': 'a'}, short=True),
+                "widgets.tests.%s -x 'a'" % widget_class.__name__)
+            self.assertEqual(
+                options_to_tag_string(widget_class, {'name': 'a'}),
+                '--other "a"')
+
+
 class TemplateTests(TestCase):
     """Test types of template for finding widgets."""
 
@@ -189,7 +270,58 @@ class TemplateTests(TestCase):
 
 class WidgetTests(TestCase):
     '''Test individual widgets.'''
-    pass  # TODO
+
+    def test_generate_uid(self):
+        widget = TestWidget2()
+        uid = widget.generate_uid({'testing': 'xyz'})
+        self.assertTrue(uid.startswith('generated_'))
+        self.assertEqual(uid, widget.generate_uid({'testing': 'xyz'}))
+        self.assertNotEqual(uid, widget.generate_uid({'testing': 'abc'}))
+        self.assertNotEqual(
+            uid, TestWidget1().generate_uid({'testing': 'xyz'}))
+
+    def test_downloadable_as(self):
+        self.assertEqual(TestWidget1().downloadable_as(), {'html': 'HTML'})
+        self.assertEqual(
+            TestWidget4().downloadable_as(),
+            {'html': 'HTML', 'svg': 'SVG', 'png': 'PNG'})
+
+    def test_generate_uid_unhashable(self):
+        widget = TestWidget2()
+        self.assertEqual(
+            widget.generate_uid({'testing': ['a', 'b']}),
+            widget.generate_uid({'testing': ['a', 'b']}))
+
+    def test_generate_uid_value_types(self):
+        widget = TestWidget2()
+        uids = set(widget.generate_uid({'testing': value})
+                   for value in (1, 1.0, True))
+        self.assertEqual(len(uids), 3)
+
+    def test_inherited_options_replaced(self):
+        class Parent(WidgetBase):
+            options = [Option('name', '-n')]
+
+        class Child(Parent):
+            pass
+
+        Parent.options = [Option('name', '-x', '--other'),
+                          Option('extra', '-e', required=False)]
+        self.assertEqual(Child._option_index['--other'].name, 'name')
+        self.assertFalse('-n' in Child._option_index)
+        self.assertEqual(Child._option_schema,
+                         (frozenset(['name']), frozenset(['name', 'extra'])))
+
+    def test_png_from_unicode_svg(self):
+        # Stand in for the converter and check what as_png hands it.
+        converter = base._svg_to_png
+        base._svg_to_png = lambda svg: svg
+        try:
+            fp = StringIO()
+            TestWidget6().as_png({}, fp)
+        finally:
+            base._svg_to_png = converter
+        self.assertEqual(fp.getvalue(), "<svg><text>caf\xc3\xa9</text></svg>")
 
 
 if __name__ == '__main__':
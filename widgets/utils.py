@@ -1,6 +1,105 @@
 '''Various widget related utilities.'''
+import sys
 import urllib
+from collections import deque
+from functools import wraps
+
 from django.utils.html import escape
+from django.utils.importlib import import_module
+
+
+# Option values that can safely be used in a cache key.
+_FROZEN_TYPES = (basestring, int, long, float, bool, type(None))
+
+
+class BoundedCache(dict):
+    '''A dict that discards its oldest entries once `size` is exceeded.'''
+
+    def __init__(self, size):
+        super(BoundedCache, self).__init__()
+        self.size = size
+        self._order = deque()
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self._order.append(key)
+            if len(self._order) > self.size:
+                dict.pop(self, self._order.popleft(), None)
+        dict.__setitem__(self, key, value)
+
+
+def cached_import(module_path):
+    '''
+    Return the module `module_path`. Modules that have already been imported
+    are taken straight from sys.modules.
+
+    '''
+    module = sys.modules.get(module_path)
+    if module is None:
+        module = import_module(module_path)
+    return module
+
+
+class cached_property(object):
+    '''
+    A property that is computed once per instance and then stored. Equivalent
+    to the decorator of the same name in later versions of
+    django.utils.functional.
+
+    '''
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = instance.__dict__[self.func.__name__] = self.func(instance)
+        return value
+
+
+def freeze_options(options):
+    '''
+    Return a hashable version of an options dictionary, or None if any of the
+    values are not simple enough to be used as a cache key.
+
+    '''
+    # 1, 1.0 and True are equal and hash alike, so the types go in the key.
+    items = []
+    for key, value in options.iteritems():
+        if isinstance(value, tuple):
+            for item in value:
+                if not isinstance(item, _FROZEN_TYPES):
+                    return None
+            value = tuple((type(item), item) for item in value)
+        elif not isinstance(value, _FROZEN_TYPES):
+            return None
+        items.append((key, type(value), value))
+    return frozenset(items)
+
+
+def _cache_by_options(func):
+    '''
+    Cache the results of `func(widget_class, options)` for options that can be
+    frozen with :py:func:`freeze_options`. Results are dropped if the widget
+    class's options are replaced.
+
+    '''
+    cache = BoundedCache(1024)
+
+    @wraps(func)
+    def wrapper(widget_class, options):
+        frozen = freeze_options(options)
+        if frozen is None:
+            return func(widget_class, options)
+        key = (widget_class, frozen)
+        # the plan is rebuilt whenever the class's options are replaced
+        plan = widget_class._arg_plan
+        entry = cache.get(key)
+        if entry is None or entry[0] is not plan:
+            entry = cache[key] = (plan, func(widget_class, options))
+        return entry[1]
+    return wrapper
 
 
 def options_to_command_string(widget_class, options, short=False):
@@ -9,75 +108,69 @@ def options_to_command_string(widget_class, options, short=False):
     i.e. the inverse of parse_command_string.
 
     '''
-    arguments = []
-    for opt in widget_class.options:
-        if opt.name in options:
-            arguments.append(short and opt.form or opt.long_form)
-            if opt.takes_argument:
-                arguments.append("'%s'" % options[opt.name])
-
-    widget_name = "%s.%s" % (widget_class.__module__, widget_class.__name__)
-    arg_string = " ".join(arguments)
-    return "%s %s" % (widget_name, arg_string)
+    arguments = [widget_class.qualified_classname()]
+    for name, short_form, long_form, takes_argument in widget_class._arg_plan:
+        if name in options:
+            arguments.append(short_form if short else long_form)
+            if takes_argument:
+                arguments.append("'%s'" % options[name])
+    return " ".join(arguments)
 
 
+@_cache_by_options
 def options_to_tag_string(widget_class, options):
     """
     Render the options part of a widget tag.
     Excludes widget class.
 
     """
-    arguments = {}
+    esc = escape
+    out = []
     for opt in widget_class.options:
-        if opt.name in options:
-            arg = opt.get_raw_value(options[opt.name])
-            if type(arg) == list and arg:
-                arguments[opt] = '%s' % " ".join(
-                    ['"%s"' % escape(v) for v in arg])
-            elif type(arg) != bool and arg:
-                arguments[opt] = '"%s"' % escape(str(arg))
-            else:
-                # only render the arg name if this is bool
-                if arg:
-                    arguments[opt] = ""
-
-    query_string = ' '.join(
-        ['%s %s' % (k.long_form, v)
-         for (k, v) in arguments.items()])
-    return query_string
+        name = opt.name
+        if name not in options:
+            continue
+        arg = opt.get_raw_value(options[name])
+        if isinstance(arg, list):
+            if arg:
+                out.append(opt.long_form + ' ' +
+                           ' '.join(['"%s"' % esc(v) for v in arg]))
+        elif isinstance(arg, bool):
+            # only render the arg name if this is bool
+            if arg:
+                out.append(opt.long_form)
+        elif arg:
+            out.append('%s "%s"' % (opt.long_form, esc(str(arg))))
+    return ' '.join(out)
 
 
+def _query_pairs(widget_class, options):
+    '''Yield the name=value pairs of a query string for `options`.'''
+    quote = urllib.quote
+    for opt in widget_class.options:
+        name = opt.name
+        if name not in options:
+            continue
+        arg = opt.get_raw_value(options[name])
+        if isinstance(arg, list):
+            for v in arg:
+                yield name + '=' + quote(str(v))
+        elif isinstance(arg, bool):
+            # only render the arg name if this is bool
+            if arg:
+                yield name + '='
+        elif arg:
+            yield name + '=' + quote(str(arg))
+
+
+@_cache_by_options
 def options_to_query_string(widget_class, options):
     """
     Render the options part of a query string.
     Excludes widget class.
 
     """
-    arguments = {}
-    list_args = {}
-    for opt in widget_class.options:
-        if opt.name in options:
-            arg = opt.get_raw_value(options[opt.name])
-            if type(arg) != bool and arg:
-                if not isinstance(arg, list):
-                    arguments[opt.name] = arg
-                else:
-                    list_args[opt.name] = arg
-            else:
-                # only render the arg name if this is bool
-                if arg:
-                    arguments[opt.name] = ""
-
-    query_string = '&'.join(
-        ['%s=%s' % (k, urllib.quote(str(v)))
-         for (k, v) in arguments.items()])
-    query_string = "%s&%s" % (query_string, "&".join(
-        ['%s=%s' % (k, urllib.quote(str(v)))
-         for k, vals in list_args.items()
-         for v in vals
-        ]))
-
-    return query_string
+    return '&'.join(_query_pairs(widget_class, options))
 
 
 def widget_render_cache_key(widget, options, context):
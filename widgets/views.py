@@ -1,19 +1,29 @@
 #!/usr/bin/env python
 # -*- coding: iso-8859-15 -*-
-import datetime
-
-from django.template import RequestContext
 from django.http import HttpResponse
 
-from widgets.template import render_to_response
 from widgets.options import process_values, BoolOption
 from widgets.base import get_widget_class
 
+# Formats widgets can be downloaded in, see WidgetBase.downloadable_as.
+_DOWNLOAD_MIMETYPES = {
+    'svg': "image/svg+xml",
+    'png': "image/png",
+    'csv': "text/csv",
+    'html': "text/html",
+}
+_DOWNLOAD_METHODS = dict(
+    (method, 'as_%s' % method) for method in _DOWNLOAD_MIMETYPES)
+_NOT_AVAILABLE = "Sorry that format is not available."
+
 def direct_to_template(request, template, extra_context=None, **kwargs):
     """
     Render a given template with any extra URL parameters in the context as
     ``{{ params }}``, using the widget response
     """
+    from django.template import RequestContext
+    from widgets.template import render_to_response
+
     if extra_context is None: extra_context = {}
     dictionary = {'params': kwargs}
     for key, value in extra_context.items():
@@ -29,55 +39,45 @@ def direct_to_template(request, template, extra_context=None, **kwargs):
 def _getquery_to_dict(options, values, drop_unfrozen=False):
     '''Translate a GET into widget values. Remove non-used options.'''
 
-    def _valid_option(opt):
-        """Various things make an option valid in the context.
-
-        Most problems come from catalogue where we present all values but
-        can turn them on or off. Other places like style page etc. use just
-        the options they need. Check for 'catalogue' and proceed accordingly.
-
-        """
-        use_key = "use:%s" % opt.name
-        return (
-            not 'catalogue' in values or
-            (use_key in values and values[use_key] == 'on') or
+    # Various things make an option valid in the context.
+    #
+    # Most problems come from catalogue where we present all values but can
+    # turn them on or off. Other places like style page etc. use just the
+    # options they need. Check for 'catalogue' and proceed accordingly.
+    is_catalogue = 'catalogue' in values
+    value_dict = {}
+    for opt in options:
+        valid = (
+            not is_catalogue or
+            values.get("use:%s" % opt.name) == 'on' or
             opt.required or
             isinstance(opt, BoolOption)
         )
-
-    value_dict = dict(
-        (opt.name, opt.get_value_from_query(values))
-        for opt in options
-        if _valid_option(opt)
-    )
-
-    value_dict.update(dict(
-        (opt.name, opt.default)
-        for opt in options
-        if not _valid_option(opt) and opt.default)
-    )
+        if valid:
+            value_dict[opt.name] = opt.get_value_from_query(values)
+        elif opt.default:
+            value_dict[opt.name] = opt.default
     return value_dict
 
 
 def widget_download_response(request, classname):
     """Retrieve a widget as a different format."""
-    method = request.GET.get("as", "svg")
-    mimetype = {
-        'svg': "image/svg+xml",
-        'png': "image/png",
-        'csv': "text/csv",
-        'html': "text/html",
-    }[method]
+    import datetime
 
+    method = request.GET.get("as", "svg")
     widget_class = get_widget_class(classname)
-    widget = widget_class()
+    if (method not in _DOWNLOAD_MIMETYPES or
+        method not in widget_class.downloadable_as()):
+        return HttpResponse(_NOT_AVAILABLE, status=404)
 
-    fn = getattr(widget, 'as_%s' % method)
+    widget = widget_class()
+    fn = getattr(widget, _DOWNLOAD_METHODS[method])
 
     values = _getquery_to_dict(widget_class.options, request.GET)
-    values = process_values(values, widget_class.options)
+    values = process_values(values, widget_class.options,
+                            widget_class._option_schema)
 
-    response = HttpResponse(mimetype=mimetype)
+    response = HttpResponse(mimetype=_DOWNLOAD_MIMETYPES[method])
     response['Content-Disposition'] = 'attachment; filename=%s_%s.%s' % (
         classname,
         datetime.datetime.now(),
@@ -86,4 +86,4 @@ def widget_download_response(request, classname):
         fn(values, response)
         return response
     except NotImplementedError:
-        return HttpResponse("Sorry that format is not available.", status=404)
+        return HttpResponse(_NOT_AVAILABLE, status=404)